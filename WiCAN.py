@@ -24,6 +24,7 @@ from PyQt5.QtCore import QTimer, QIODevice, QByteArray
 from PyQt5.QtGui import QColor, QIcon
 
 from version import VERSION
+from trigger import CANTrigger
 
 class CANThread(QThread):
     can_recv_signal = pyqtSignal(object)
@@ -35,7 +36,12 @@ class CANThread(QThread):
         
     def connect(self, _type, _channel, _bitrate):
         try:
-            self.bus = can.interface.Bus(bustype=_type, channel=_channel, bitrate=_bitrate, single_handle=True)
+            if _type == 'serial':
+                # Only the Serial bustype needs pyserial
+                from serialbus import SerialBus
+                self.bus = SerialBus(channel=_channel, bitrate=_bitrate)
+            else:
+                self.bus = can.interface.Bus(bustype=_type, channel=_channel, bitrate=_bitrate, single_handle=True)
             print("Connected to CAN device")
             self.can_status_signal.emit(0)
         except:
@@ -95,6 +101,7 @@ class MDIWindow(QMainWindow):
         self.dbc_send_windows = {}
         self.config = configparser.ConfigParser()
         self.recentDBCFiles = {}
+        self.trigger = None
 
         self.last_connection = ""
         
@@ -110,6 +117,7 @@ class MDIWindow(QMainWindow):
         file = bar.addMenu("File")
         file.addAction("Connect")
         file.addAction("Open DBC")
+        file.addAction("Trigger Capture")
         file.triggered[QAction].connect(self.fileMenuClicked)
         file.addMenu(recentDBCMenu)
 
@@ -170,6 +178,8 @@ class MDIWindow(QMainWindow):
             self.CANConnect(settings)
         elif menuitem.text() == "Open DBC":
             self.loadDBCFileDialog()
+        elif menuitem.text() == "Trigger Capture":
+            self.triggerDialog()
 
     def viewMenuClicked(self, menuitem):
         if menuitem.text() == "Cascade":
@@ -185,6 +195,7 @@ class MDIWindow(QMainWindow):
         if len(inifile) == 0:
             self.config['WiCAN'] = {'CANAdaptor': 'PCAN', 'CANBAUD': '250k', 'CANPATH': ''}
             self.config['RecentDBCs'] = {}
+            self.config['Trigger'] = {'Condition': '', 'PreFrames': '1000', 'PostFrames': '1000'}
             self.saveConfig()
             return
 
@@ -233,6 +244,71 @@ class MDIWindow(QMainWindow):
             self.dbc_path = os.path.split(file_path)[0]
             self.saveConfig()
 
+    def triggerDialog(self):
+        if not self.config.has_section('Trigger'):
+            self.config['Trigger'] = {}
+
+        last_condition = self.config['Trigger'].get('Condition', '')
+        condition, ok = QInputDialog.getText(self, "Trigger Capture", "Condition (empty to disarm):", QLineEdit.Normal, last_condition)
+        if not ok:
+            return
+
+        if condition.strip() == "":
+            self.stopTrigger()
+            self.statusBar().showMessage("Trigger disarmed")
+            return
+
+        options = QFileDialog.Options()
+        options |= QFileDialog.DontUseNativeDialog
+        types = "ASC Files (*.asc);;BLF Files (*.blf);;Log Files (*.log);;CSV Files (*.csv)"
+        file_path, _ = QFileDialog.getSaveFileName(self, "Capture File", self.dbc_path, types, options=options)
+        if not file_path:
+            return
+        if os.path.splitext(file_path)[1] == "":
+            file_path += ".asc"
+
+        dbcs = [window.dbc for window in self.dbc_windows.values()]
+
+        try:
+            pre_frames = self.triggerFrames('PreFrames')
+            post_frames = self.triggerFrames('PostFrames')
+            trigger = CANTrigger(condition, dbcs, file_path, pre_frames, post_frames)
+        except ValueError as e:
+            self.statusBar().showMessage(str(e))
+            return
+
+        # Only replace the armed trigger once the new one is ready
+        self.stopTrigger()
+        self.trigger = trigger
+
+        # Escape % so the condition survives config interpolation
+        self.config['Trigger']['Condition'] = condition.replace('%', '%%')
+        self.saveConfig()
+        self.statusBar().showMessage("Trigger armed: "+condition)
+
+    def triggerFrames(self, key):
+        try:
+            frames = self.config.getint('Trigger', key, fallback=1000)
+        except ValueError:
+            raise ValueError("[Trigger] "+key+" in wican.ini must be a whole number")
+        if frames < 0:
+            raise ValueError("[Trigger] "+key+" in wican.ini must not be negative")
+        return frames
+
+    def stopTrigger(self):
+        if self.trigger != None:
+            try:
+                self.trigger.stop()
+            except:
+                print("Failed to stop trigger capture")
+                traceback.print_exc()
+            self.trigger = None
+
+    def closeEvent(self, event):
+        # Finish a capture that is still in its post-trigger window
+        self.stopTrigger()
+        super().closeEvent(event)
+
     @pyqtSlot(int)
     def handleCANStatus(self, status):
         if status == 1:
@@ -266,6 +342,9 @@ class MDIWindow(QMainWindow):
         elif bustype == 'Ixxat':
             bustype = 'ixxat'
             interface = '0'
+        elif bustype == 'Serial':
+            bustype = 'serial'
+            interface = path
         else:
             print("Unknown bustype: "+bustype)
 
@@ -287,6 +366,18 @@ class MDIWindow(QMainWindow):
 
     @pyqtSlot(object)
     def handleCANMessage(self, msg):
+        if self.trigger != None:
+            try:
+                capture_path = self.trigger.handleCANMessage(msg)
+            except:
+                print("Trigger capture failed")
+                traceback.print_exc()
+                self.stopTrigger()
+                self.statusBar().showMessage("Trigger disarmed: capture failed")
+                capture_path = None
+            if capture_path != None:
+                self.statusBar().showMessage("Trigger captured to "+capture_path)
+
         for file_name,window in self.dbc_windows.items():
             window.handleCANMessage(msg)
 
@@ -0,0 +1,248 @@
+import binascii
+import collections
+import struct
+import threading
+import time
+
+import can
+import serial
+
+# SLCAN frame type -> (ID length in hex digits, extended, remote)
+SLCAN_FRAME_TYPES = {
+    ord('t'): (3, False, False),
+    ord('T'): (8, True, False),
+    ord('r'): (3, False, True),
+    ord('R'): (8, True, True),
+}
+
+# ASCII byte -> DLC, -1 for anything that is not a valid classic CAN length
+SLCAN_DLC = [-1] * 256
+for i in range(9):
+    SLCAN_DLC[ord('0')+i] = i
+
+SLCAN_BITRATES = {
+    10000: b'S0',
+    20000: b'S1',
+    50000: b'S2',
+    100000: b'S3',
+    125000: b'S4',
+    250000: b'S5',
+    500000: b'S6',
+    800000: b'S7',
+    1000000: b'S8',
+}
+
+# WiCAN binary frame: 0xAA, ms (u32), dlc (u8), id (u32), data[dlc], 0xBB
+WICAN_START = 0xAA
+WICAN_END = 0xBB
+WICAN_HEADER = struct.Struct('<IBI')
+WICAN_MIN_LEN = 11
+
+class SerialBus(can.BusABC):
+    DEFAULT_BAUD = 2000000
+    READ_TIMEOUT = 0.01
+    TX_BATCH_SIZE = 512
+    TX_MAX_DELAY = 0.005
+    RECV_IDLE = 0.05
+    MAX_LINE = 64
+
+    def __init__(self, channel, bitrate=None, protocol='slcan', baudrate=None, **kwargs):
+        # Channel is "[slcan:|wican:]port[@baudrate]", e.g. "wican:COM3@921600"
+        port = channel
+        if ':' in port and port.split(':', 1)[0] in ('slcan', 'wican'):
+            protocol, port = port.split(':', 1)
+        if '@' in port:
+            port, baud = port.rsplit('@', 1)
+            baudrate = int(baud)
+        if baudrate is None:
+            baudrate = self.DEFAULT_BAUD
+
+        if protocol == 'slcan':
+            self.parse = self.parseSLCAN
+            self.encode = self.encodeSLCAN
+        elif protocol == 'wican':
+            self.parse = self.parseWiCAN
+            self.encode = self.encodeWiCAN
+        else:
+            raise ValueError("Unknown serial protocol: "+protocol)
+
+        self.serial_protocol = protocol
+        self.channel_info = protocol+" "+port+"@"+str(baudrate)
+        self.rx_buffer = bytearray()
+        self.rx_queue = collections.deque()
+        self.tx_buffer = bytearray()
+        self.tx_lock = threading.Lock()
+        self.tx_queued_at = 0.0
+        self.recv_seen = 0.0
+        self.time_offset = None
+
+        # serial_for_url also accepts plain device paths such as COM1 or /dev/pts/3
+        self.ser = serial.serial_for_url(port, baudrate=baudrate, timeout=self.READ_TIMEOUT)
+
+        if protocol == 'slcan':
+            self.ser.write(b'C\r')
+            if bitrate is not None:
+                try:
+                    self.ser.write(SLCAN_BITRATES[bitrate]+b'\r')
+                except KeyError:
+                    self.ser.close()
+                    raise ValueError("Unsupported SLCAN bitrate: "+str(bitrate))
+            self.ser.write(b'O\r')
+
+        super().__init__(channel=channel, **kwargs)
+
+    def parseSLCAN(self):
+        end = self.rx_buffer.rfind(b'\r')
+        if end < 0:
+            # Drop line noise that never terminates
+            if len(self.rx_buffer) > self.MAX_LINE:
+                del self.rx_buffer[:]
+            return
+        lines = bytes(self.rx_buffer[:end]).split(b'\r')
+        del self.rx_buffer[:end+1]
+
+        timestamp = time.time()
+        for line in lines:
+            if not line:
+                continue
+            if line[0] == 0x07:
+                # BELL marks an error reply from the adapter
+                line = line.lstrip(b'\x07')
+                if not line:
+                    continue
+
+            frame_type = SLCAN_FRAME_TYPES.get(line[0])
+            if frame_type is None:
+                continue
+            id_len, extended, remote = frame_type
+
+            if len(line) < id_len+2:
+                continue
+            dlc = SLCAN_DLC[line[id_len+1]]
+            if dlc < 0:
+                continue
+
+            try:
+                can_id = int(line[1:id_len+1], 16)
+                if remote:
+                    data = None
+                else:
+                    data_end = id_len+2+2*dlc
+                    if len(line) < data_end:
+                        continue
+                    data = binascii.unhexlify(line[id_len+2:data_end])
+            except (ValueError, binascii.Error):
+                continue
+
+            self.rx_queue.append(can.Message(timestamp=timestamp, arbitration_id=can_id, is_extended_id=extended,
+                is_remote_frame=remote, dlc=dlc, data=data, channel=self.channel_info))
+
+    def parseWiCAN(self):
+        buf = self.rx_buffer
+        length = len(buf)
+        pos = 0
+        while True:
+            start = buf.find(WICAN_START, pos)
+            if start < 0:
+                pos = length
+                break
+            if length-start < WICAN_MIN_LEN:
+                pos = start
+                break
+
+            msecs, dlc, can_id = WICAN_HEADER.unpack_from(buf, start+1)
+            if dlc > 8:
+                pos = start+1
+                continue
+            end = start+10+dlc
+            if end >= length:
+                pos = start
+                break
+            if buf[end] != WICAN_END:
+                # Lost sync, look for the next start byte
+                pos = start+1
+                continue
+
+            if self.time_offset is None:
+                self.time_offset = time.time()-msecs/1000.0
+
+            self.rx_queue.append(can.Message(timestamp=self.time_offset+msecs/1000.0, arbitration_id=can_id,
+                is_extended_id=can_id > 0x7FF, dlc=dlc, data=bytes(buf[start+10:end]), channel=self.channel_info))
+            pos = end+1
+        del buf[:pos]
+
+    def encodeSLCAN(self, msg):
+        if msg.is_extended_id:
+            frame = b'%c%08X%d' % (b'R' if msg.is_remote_frame else b'T', msg.arbitration_id, msg.dlc)
+        else:
+            frame = b'%c%03X%d' % (b'r' if msg.is_remote_frame else b't', msg.arbitration_id, msg.dlc)
+        if not msg.is_remote_frame:
+            frame += binascii.hexlify(bytes(msg.data)).upper()
+        return frame+b'\r'
+
+    def encodeWiCAN(self, msg):
+        msecs = int(time.time()*1000) & 0xFFFFFFFF
+        header = bytes([WICAN_START])+WICAN_HEADER.pack(msecs, msg.dlc, msg.arbitration_id)
+        return header+bytes(msg.data)+bytes([WICAN_END])
+
+    def flushTx(self):
+        if not self.tx_buffer:
+            return
+        with self.tx_lock:
+            if self.tx_buffer:
+                self.ser.write(self.tx_buffer)
+                self.tx_buffer = bytearray()
+
+    def send(self, msg, timeout=None):
+        # Both framings only carry classic CAN frames
+        if msg.is_fd:
+            raise ValueError("CAN FD frames are not supported over serial")
+        if msg.dlc > 8 or len(msg.data) > 8:
+            raise ValueError("Serial frames carry at most 8 data bytes")
+        if msg.is_extended_id and msg.arbitration_id > 0x1FFFFFFF:
+            raise ValueError("Extended ID out of range: "+hex(msg.arbitration_id))
+        if not msg.is_extended_id and msg.arbitration_id > 0x7FF:
+            raise ValueError("Standard ID out of range: "+hex(msg.arbitration_id))
+
+        # Frames are batched while a receive loop is running to flush them, otherwise written straight away
+        now = time.time()
+        with self.tx_lock:
+            if not self.tx_buffer:
+                self.tx_queued_at = now
+            self.tx_buffer += self.encode(msg)
+            flush = (len(self.tx_buffer) >= self.TX_BATCH_SIZE
+                or now-self.tx_queued_at >= self.TX_MAX_DELAY
+                or now-self.recv_seen >= self.RECV_IDLE)
+        if flush:
+            self.flushTx()
+
+    def _recv_internal(self, timeout):
+        self.recv_seen = time.time()
+        self.flushTx()
+        if self.rx_queue:
+            return self.rx_queue.popleft(), False
+
+        deadline = None if timeout is None else self.recv_seen+timeout
+        while True:
+            self.recv_seen = time.time()
+            self.flushTx()
+
+            # Block for at most READ_TIMEOUT, then take everything the driver has buffered
+            data = self.ser.read(max(1, self.ser.in_waiting))
+            if data:
+                self.rx_buffer += data
+                self.parse()
+                if self.rx_queue:
+                    return self.rx_queue.popleft(), False
+
+            if deadline is not None and time.time() >= deadline:
+                return None, False
+
+    def shutdown(self):
+        try:
+            self.flushTx()
+            if self.serial_protocol == 'slcan':
+                self.ser.write(b'C\r')
+        finally:
+            self.ser.close()
+            super().shutdown()
@@ -0,0 +1,147 @@
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import pytest
+
+can = pytest.importorskip("can")
+pytest.importorskip("serial")
+
+if sys.platform == "win32":
+    pytest.skip("pty stand-in device needs a POSIX system", allow_module_level=True)
+
+import pty
+import tty
+
+from serialbus import SerialBus
+
+MIN_FRAMES_PER_SEC = 8000
+FRAME_COUNT = 20000
+
+@pytest.fixture
+def device():
+    # The master side plays the adapter, the slave path is what SerialBus opens
+    master, slave = pty.openpty()
+    tty.setraw(master)
+    yield master, os.ttyname(slave)
+    os.close(master)
+    os.close(slave)
+
+def readDevice(master, timeout=0.5):
+    data = b''
+    deadline = time.time()+timeout
+    while time.time() < deadline:
+        ready, _, _ = select.select([master], [], [], 0.05)
+        if ready:
+            data += os.read(master, 4096)
+        elif data:
+            break
+    return data
+
+def writeDevice(master, data):
+    view = memoryview(data)
+    while view:
+        n = os.write(master, view[:4096])
+        view = view[n:]
+
+def receiveAll(bus, master, data, count):
+    writer = threading.Thread(target=writeDevice, args=(master, data))
+    start = time.perf_counter()
+    writer.start()
+    frames = []
+    while len(frames) < count:
+        msg = bus.recv(1.0)
+        if msg is None:
+            break
+        frames.append(msg)
+    elapsed = time.perf_counter()-start
+    writer.join()
+    return frames, len(frames)/elapsed
+
+def test_slcan_open_sequence(device):
+    master, path = device
+    bus = SerialBus(channel="slcan:"+path, bitrate=250000)
+    try:
+        assert readDevice(master) == b'C\rS5\rO\r'
+    finally:
+        bus.shutdown()
+
+def test_slcan_transmit_without_recv(device):
+    master, path = device
+    bus = SerialBus(channel="slcan:"+path, bitrate=250000)
+    try:
+        readDevice(master)
+        bus.send(can.Message(arbitration_id=0x123, data=b'\x01\x02', is_extended_id=False))
+        bus.send(can.Message(arbitration_id=0x1ABCDEF0, is_extended_id=True, is_remote_frame=True, dlc=0))
+        assert readDevice(master) == b't12320102\rR1ABCDEF00\r'
+    finally:
+        bus.shutdown()
+
+@pytest.mark.parametrize("protocol", ["slcan", "wican"])
+@pytest.mark.parametrize("msg", [
+    can.Message(arbitration_id=0x123, data=bytes(12), is_extended_id=False, check=False),
+    can.Message(arbitration_id=0x123, data=bytes(8), is_extended_id=False, is_fd=True),
+    can.Message(arbitration_id=0x800, data=b'\x01', is_extended_id=False, check=False),
+])
+def test_transmit_rejects_unsupported_frames(device, protocol, msg):
+    master, path = device
+    bus = SerialBus(channel=protocol+":"+path)
+    try:
+        readDevice(master)
+        with pytest.raises(ValueError):
+            bus.send(msg)
+        bus.flushTx()
+        assert readDevice(master, timeout=0.1) == b''
+    finally:
+        bus.shutdown()
+
+def test_wican_transmit_encoding(device):
+    master, path = device
+    bus = SerialBus(channel="wican:"+path)
+    try:
+        bus.send(can.Message(arbitration_id=0x18FF00FE, data=b'\x01\x02\x03', is_extended_id=True))
+        data = readDevice(master)
+        assert len(data) == 14
+        assert data[0] == 0xAA and data[-1] == 0xBB
+        assert data[5] == 3
+        assert struct.unpack_from('<I', data, 6)[0] == 0x18FF00FE
+        assert data[10:13] == b'\x01\x02\x03'
+    finally:
+        bus.shutdown()
+
+def test_slcan_decode_throughput(device):
+    master, path = device
+    bus = SerialBus(channel="slcan:"+path, bitrate=250000)
+    try:
+        readDevice(master)
+        data = b''.join(b't1238DEADBEEF00112233\r' if i % 2 else b'T1ABCDEF02AB01\r' for i in range(FRAME_COUNT))
+        frames, rate = receiveAll(bus, master, data, FRAME_COUNT)
+    finally:
+        bus.shutdown()
+
+    assert len(frames) == FRAME_COUNT
+    assert frames[0].arbitration_id == 0x1ABCDEF0 and frames[0].is_extended_id
+    assert bytes(frames[0].data) == b'\xab\x01'
+    assert frames[1].arbitration_id == 0x123 and not frames[1].is_extended_id
+    assert bytes(frames[1].data) == bytes.fromhex('DEADBEEF00112233')
+    assert rate >= MIN_FRAMES_PER_SEC
+
+def test_wican_decode_throughput(device):
+    master, path = device
+    bus = SerialBus(channel="wican:"+path)
+    try:
+        # Leading noise checks that the parser resyncs on the start byte
+        data = b'\x00\xaa\x12'+b''.join(b'\xaa'+struct.pack('<IBI', i, 8, 0x18FF00FE)+bytes(range(8))+b'\xbb'
+            for i in range(FRAME_COUNT))
+        frames, rate = receiveAll(bus, master, data, FRAME_COUNT)
+    finally:
+        bus.shutdown()
+
+    assert len(frames) == FRAME_COUNT
+    assert frames[0].arbitration_id == 0x18FF00FE and frames[0].is_extended_id
+    assert bytes(frames[-1].data) == bytes(range(8))
+    assert abs((frames[-1].timestamp-frames[0].timestamp)-(FRAME_COUNT-1)/1000.0) < 1e-6
+    assert rate >= MIN_FRAMES_PER_SEC
@@ -0,0 +1,155 @@
+import pytest
+
+can = pytest.importorskip("can")
+cantools = pytest.importorskip("cantools")
+
+from trigger import CANTrigger
+
+DBC = """VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Engine: 8 ECU
+ SG_ EngineSpeed : 0|16@1+ (1,0) [0|10000] "rpm" ECU
+
+BO_ 512 Transmission: 8 ECU
+ SG_ Gear : 0|8@1+ (1,0) [0|255] "" ECU
+
+VAL_ 512 Gear 0 "P" 1 "R" 2 "N" 3 "D" ;
+"""
+
+@pytest.fixture
+def dbc():
+    return cantools.database.load_string(DBC, database_format='dbc')
+
+def frame(can_id, data, timestamp=0.0):
+    return can.Message(timestamp=timestamp, arbitration_id=can_id, data=data, is_extended_id=False)
+
+def engine(rpm, timestamp=0.0):
+    return frame(0x100, rpm.to_bytes(2, 'little')+bytes(6), timestamp)
+
+def gear(value, timestamp=0.0):
+    return frame(0x200, bytes([value])+bytes(7), timestamp)
+
+def feed(trigger, frames):
+    captures = []
+    for msg in frames:
+        path = trigger.handleCANMessage(msg)
+        if path is not None:
+            captures.append(path)
+    return captures
+
+def readCapture(path):
+    return [(msg.arbitration_id, bytes(msg.data)) for msg in can.LogReader(path)]
+
+@pytest.mark.parametrize("condition, watch_ids", [
+    ("EngineSpeed > 4000 and Gear == 'R'", {0x100, 0x200}),
+    ("id == 0x123 and data[0] & 0x80", {0x123}),
+    ("Gear == 'R' or id == 0x123", None),
+    ("id == 0x123 or id in (0x124, 0x125)", {0x123, 0x124, 0x125}),
+    ("id in (0x123, 0x124) and id == 0x124", {0x124}),
+    ("data[0] > 3", None),
+])
+def test_watch_ids(dbc, tmp_path, condition, watch_ids):
+    trigger = CANTrigger(condition, [dbc], str(tmp_path/"capture.asc"))
+    if watch_ids is None:
+        assert trigger.watch_ids is None
+    else:
+        assert trigger.watch_ids == frozenset(watch_ids)
+
+@pytest.mark.parametrize("condition", [
+    "__import__('os')",
+    "data.hex()",
+    "data.hex",
+    "Unknown > 1",
+    "1 == 1",
+    "EngineSpeed >",
+])
+def test_compile_rejects(dbc, tmp_path, condition):
+    with pytest.raises(ValueError):
+        CANTrigger(condition, [dbc], str(tmp_path/"capture.asc"))
+
+def test_capture_pre_and_post_window(dbc, tmp_path):
+    trigger = CANTrigger("EngineSpeed > 4000 and Gear == 'R'", [dbc], str(tmp_path/"capture.asc"), pre_frames=2, post_frames=2)
+    frames = [
+        frame(0x300, b'\x00'),
+        gear(1),
+        frame(0x300, b'\x01'),
+        engine(3000),
+        engine(5000),
+        frame(0x300, b'\x02'),
+        frame(0x300, b'\x03'),
+        frame(0x300, b'\x04'),
+    ]
+    captures = feed(trigger, frames)
+
+    assert len(captures) == 1
+    assert readCapture(captures[0]) == [
+        (0x300, b'\x01'),
+        (0x100, (3000).to_bytes(2, 'little')+bytes(6)),
+        (0x100, (5000).to_bytes(2, 'little')+bytes(6)),
+        (0x300, b'\x02'),
+        (0x300, b'\x03'),
+    ]
+
+def test_raw_condition_uses_signals_from_unwatched_ids(dbc, tmp_path):
+    trigger = CANTrigger("id == 0x123 and EngineSpeed > 4000", [dbc], str(tmp_path/"capture.asc"), pre_frames=0, post_frames=0)
+    captures = feed(trigger, [frame(0x123, b'\x00'), engine(5000), frame(0x123, b'\x01')])
+
+    assert len(captures) == 1
+    assert readCapture(captures[0]) == [(0x123, b'\x01')]
+
+def test_fires_on_rising_edge_only(dbc, tmp_path):
+    trigger = CANTrigger("id == 0x123 and data[0] & 0x80", [dbc], str(tmp_path/"capture.asc"), pre_frames=0, post_frames=0)
+    captures = feed(trigger, [
+        frame(0x123, b'\x80'),
+        frame(0x123, b'\x81'),
+        frame(0x123, b'\x00'),
+        frame(0x123, b'\x82'),
+    ])
+
+    assert len(captures) == 2
+    assert captures[0] != captures[1]
+    assert readCapture(captures[0]) == [(0x123, b'\x80')]
+    assert readCapture(captures[1]) == [(0x123, b'\x82')]
+
+def test_ring_is_capped(dbc, tmp_path):
+    trigger = CANTrigger("id == 0x123", [dbc], str(tmp_path/"capture.asc"), pre_frames=3, post_frames=0)
+    feed(trigger, [frame(0x300, bytes([i])) for i in range(100)])
+
+    assert len(trigger.ring) == 3
+    captures = feed(trigger, [frame(0x123, b'\xff')])
+    assert readCapture(captures[0]) == [(0x300, b'\x61'), (0x300, b'\x62'), (0x300, b'\x63'), (0x123, b'\xff')]
+
+def test_zero_pre_frames_keeps_trigger_frame(dbc, tmp_path):
+    trigger = CANTrigger("id == 0x123", [dbc], str(tmp_path/"capture.asc"), pre_frames=0, post_frames=3)
+    captures = feed(trigger, [frame(0x300, b'\x00'), frame(0x123, b'\x01')]+[frame(0x300, bytes([i])) for i in range(3)])
+
+    assert len(captures) == 1
+    assert readCapture(captures[0]) == [(0x123, b'\x01'), (0x300, b'\x00'), (0x300, b'\x01'), (0x300, b'\x02')]
+
+def test_zero_post_frames_completes_on_trigger(dbc, tmp_path):
+    trigger = CANTrigger("id == 0x123", [dbc], str(tmp_path/"capture.asc"), pre_frames=1, post_frames=0)
+
+    assert trigger.handleCANMessage(frame(0x300, b'\x00')) is None
+    path = trigger.handleCANMessage(frame(0x123, b'\x01'))
+    assert path is not None
+    assert trigger.writer is None
+    assert readCapture(path) == [(0x300, b'\x00'), (0x123, b'\x01')]
+
+def test_stop_finishes_open_capture(dbc, tmp_path):
+    trigger = CANTrigger("id == 0x123", [dbc], str(tmp_path/"capture.asc"), pre_frames=0, post_frames=10)
+    assert feed(trigger, [frame(0x123, b'\x01'), frame(0x300, b'\x02')]) == []
+
+    trigger.stop()
+    captures = list(tmp_path.glob("capture_*.asc"))
+    assert len(captures) == 1
+    assert readCapture(str(captures[0])) == [(0x123, b'\x01'), (0x300, b'\x02')]
+    assert "End TriggerBlock" in captures[0].read_text()
+
+    # A stopped trigger does not capture again
+    assert feed(trigger, [frame(0x300, b'\x00'), frame(0x123, b'\x01')]) == []
@@ -0,0 +1,192 @@
+import ast
+import collections
+import os
+import time
+
+import can
+
+# Names that refer to the raw frame rather than a decoded DBC signal
+RAW_NAMES = ("id", "dlc", "data")
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd, ast.Invert,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.BitAnd, ast.BitOr, ast.BitXor, ast.LShift, ast.RShift,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+    ast.Name, ast.Load, ast.Constant, ast.Subscript, ast.Slice, ast.Tuple, ast.List,
+)
+if hasattr(ast, "Index"):
+    # Subscripts are wrapped in Index nodes before Python 3.9
+    ALLOWED_NODES += (ast.Index,)
+
+class CANTrigger():
+    def __init__(self, condition, dbcs, file_path, pre_frames=1000, post_frames=1000):
+        self.condition = condition
+        self.file_path = file_path
+        self.pre_frames = pre_frames
+        self.post_frames = post_frames
+
+        # Fixed size ring buffer of raw frames seen before the trigger
+        self.ring = collections.deque(maxlen=pre_frames)
+
+        self.values = {}
+        self.decoders = {}
+        self.watch_ids = None
+        self.armed = True
+        self.last_result = False
+        self.writer = None
+        self.post_remaining = 0
+        self.capture_count = 0
+
+        self.compile(dbcs)
+
+    def compile(self, dbcs):
+        try:
+            tree = ast.parse(self.condition, mode='eval')
+        except SyntaxError as e:
+            raise ValueError("Invalid trigger condition: "+str(e.msg))
+
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError("Unsupported expression in trigger: "+type(node).__name__)
+
+        names = set(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+        if not names:
+            raise ValueError("Trigger condition does not reference a signal or frame field")
+
+        # Map every referenced signal to the messages that carry it
+        signal_ids = set()
+        for name in names - set(RAW_NAMES):
+            found = False
+            for dbc in dbcs:
+                for message in dbc.messages:
+                    if name in [signal.name for signal in message.signals]:
+                        found = True
+                        signal_ids.add(message.frame_id)
+                        if message.frame_id not in self.decoders:
+                            self.decoders[message.frame_id] = message
+            if not found:
+                raise ValueError("Unknown signal in trigger: "+name)
+
+        # Only frames that can change the outcome need to be evaluated
+        if names & set(RAW_NAMES):
+            raw_ids = self.idFilter(tree.body)
+            if raw_ids is not None:
+                self.watch_ids = frozenset(raw_ids)
+            else:
+                self.watch_ids = None
+        else:
+            self.watch_ids = frozenset(signal_ids)
+
+        self.code = compile(tree, '<trigger>', 'eval')
+
+    def idFilter(self, node):
+        # Returns the set of IDs a frame must have for the expression to be true, or None if any ID can match
+        if isinstance(node, ast.Compare) and len(node.ops) == 1:
+            left = node.left
+            right = node.comparators[0]
+            if isinstance(left, ast.Name) and left.id == "id":
+                if isinstance(node.ops[0], ast.Eq) and isinstance(right, ast.Constant):
+                    return {right.value}
+                if isinstance(node.ops[0], ast.In) and isinstance(right, (ast.Tuple, ast.List)):
+                    if all(isinstance(e, ast.Constant) for e in right.elts):
+                        return set(e.value for e in right.elts)
+            if isinstance(right, ast.Name) and right.id == "id":
+                if isinstance(node.ops[0], ast.Eq) and isinstance(left, ast.Constant):
+                    return {left.value}
+            return None
+
+        if isinstance(node, ast.BoolOp):
+            filters = [self.idFilter(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                result = None
+                for f in filters:
+                    if f is not None:
+                        result = f if result is None else result & f
+                return result
+            if None in filters:
+                return None
+            return set().union(*filters)
+
+        return None
+
+    def updateSignals(self, msg):
+        try:
+            frame = self.decoders[msg.arbitration_id].decode(msg.data, decode_choices=True, scaling=True)
+        except:
+            return
+        for signal in frame:
+            value = frame[signal]
+            # Choice values compare by their name, e.g. Gear == 'R'
+            if not isinstance(value, (int, float)):
+                value = str(value)
+            self.values[signal] = value
+
+    def evaluate(self, msg):
+        can_id = msg.arbitration_id
+        self.values["id"] = can_id
+        self.values["dlc"] = msg.dlc
+        self.values["data"] = msg.data
+
+        try:
+            return bool(eval(self.code, {'__builtins__': {}}, self.values))
+        except:
+            # Signals that have not been received yet make the condition false
+            return False
+
+    def handleCANMessage(self, msg):
+        # Returns the file path when a capture completes, otherwise None
+        if msg.arbitration_id in self.decoders:
+            self.updateSignals(msg)
+
+        if self.writer is not None:
+            self.writer.on_message_received(msg)
+            self.post_remaining -= 1
+            if self.post_remaining <= 0:
+                return self.finishCapture()
+            return None
+
+        if self.watch_ids is not None and msg.arbitration_id not in self.watch_ids:
+            self.ring.append(msg)
+            return None
+
+        result = self.evaluate(msg)
+        fired = result and not self.last_result
+        self.last_result = result
+
+        if fired and self.armed:
+            self.startCapture(msg)
+            if self.post_remaining <= 0:
+                return self.finishCapture()
+            return None
+
+        self.ring.append(msg)
+        return None
+
+    def startCapture(self, trigger_msg):
+        base, ext = os.path.splitext(self.file_path)
+        now = time.time()
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))+"_%03d" % (int(now*1000) % 1000)
+        # Never overwrite an earlier capture, even from a previous trigger
+        while True:
+            self.capture_path = base+"_"+stamp+"_"+str(self.capture_count)+ext
+            self.capture_count += 1
+            if not os.path.exists(self.capture_path):
+                break
+
+        self.writer = can.Logger(self.capture_path)
+        for msg in self.ring:
+            self.writer.on_message_received(msg)
+        self.writer.on_message_received(trigger_msg)
+        self.ring.clear()
+        self.post_remaining = self.post_frames
+
+    def finishCapture(self):
+        self.writer.stop()
+        self.writer = None
+        return self.capture_path
+
+    def stop(self):
+        if self.writer is not None:
+            self.finishCapture()
+        self.armed = False